@@ -1,20 +1,51 @@
 import asyncio
+from dataclasses import dataclass, field
 from redis import asyncio as aioredis
 from redis import Redis
-import operations as ops
+from redis.asyncio.client import PubSub
+import scripts
+from scripts import SCRIPT_STATUS
 from states import AGENT_STATE, CONTACT_STATE
 from dotenv import load_dotenv
 import os
-from response import Response, RESPONSE_TYPE
-from random import uniform
 import logging
+import uvloop
 
 logging.basicConfig(format='%(asctime)s %(message)s')
 logger = logging.getLogger('dispatcher')
 logger.setLevel(logging.INFO)
 logger.info('Dispatcher started')
 
-async def dispatch(client: Redis) -> None:
+AVAIL_WAIT = 2 # max secs to wait for an agent to become available before retrying
+
+@dataclass(slots=True)
+class Availability:
+    count: int = 0  # number of agent_available notifications received by this process
+    cond: asyncio.Condition = field(default_factory=asyncio.Condition)
+
+async def listen(pubsub: PubSub, avail: Availability) -> None:
+    """ 
+        Reads the agent_available channel continuously on behalf of all dispatch workers in this process and wakes
+        any worker waiting for an agent.  A single reader keeps notifications from accumulating unread on the
+        subscription while workers are blocked on the queue.
+        
+        Parameters
+        ----------
+        pubsub - PubSub subscribed to the agent_available channel
+        avail - notification counter shared with the dispatch workers
+ 
+        Returns
+        -------
+        None
+    """
+    async for message in pubsub.listen():
+        if message['type'] == 'message':
+            async with avail.cond:
+                avail.count += 1
+                avail.cond.notify_all()
+
+async def dispatch(client: Redis,
+                   avail: Availability) -> None:
     """ 
         Monitors a FIFO queue for new contacts and then routes them to an agent.  
             - Queue is realized via a Redis Sorted Set.  Members of that set are contacts and the scores are timestamps
@@ -24,10 +55,14 @@ async def dispatch(client: Redis) -> None:
             - Available agents are stored in Sorted Sets, 1 set per skill.  Scoring is a timestamp of when the agent is available.
             - Matching of contacts and agents is done with a Sorted Set intersection of skills.  This obtains the longest available
                 agent (LAA) with the requisite skills.
+            - Agent selection, the agent state change and the contact update are performed atomically by a single Lua script.
+            - When no agent is available, the contact is requeued and the dispatcher waits for an agent to become available
+                (pub/sub notification) before retrying.
         
         Parameters
         ----------
         client - Redis asyncio client
+        avail - agent_available notification counter maintained by the listener
  
         Returns
         -------
@@ -36,36 +71,54 @@ async def dispatch(client: Redis) -> None:
     while True:
         try:
             response: list[tuple] = await client.bzpopmin('queue') # using a sorted set as a fifo queue
-            contact_key: str = response[1].decode('utf-8')
+            contact_key: str = response[1]
             timestamp: int = int(response[2])
-            skills: list[list[str]] = await client.json().get(contact_key, '$.skills')
-            avail_keys: list[str] = [f'{{availAgentsSkill}}:{skill}' for skill in skills[0]]
-            agents: list[str]  = await client.zinter(avail_keys)
-            agents = [agent.decode('utf-8') for agent in agents]
-            found: bool = False
-            for agent in agents:
-                response: Response = await ops.set_agent_state(client, agent, AGENT_STATE.UNAVAILABLE)
-                if response.resp_type == RESPONSE_TYPE.OK:
-                    found = True
-                    await client.json().mset([(contact_key, '$.agent', agent), 
-                                          (contact_key, '$.state', CONTACT_STATE.ASSIGNED.value)])
-                    logger.info(f'{contact_key} assigned to {agent}')
-                    break
-  
-            if not found:
-                # check if the contact has been abandoned
-                state: list[int] = (await client.json().get(contact_key, '$.state'))[0]
-                if CONTACT_STATE(state) != CONTACT_STATE.COMPLETE:
-                    # no agent avail.  put contact back on queue with a 1 sec decelerator to allow other contacts to bubble up
-                    await client.zadd('queue', mapping={ contact_key: timestamp+1000 }) 
-                    logger.info(f'{contact_key} queued')
-                    await asyncio.sleep(uniform(0, 2))
+            seen: int = avail.count  # recorded before the script so a release during it isn't missed
+            # if no agent is avail, the script puts the contact back on queue with a 1 sec decelerator to allow other 
+            # contacts to bubble up.  Abandoned contacts are dropped.
+            status, agent = await scripts.run(client, 'dispatch', 2, contact_key, 'queue',
+                                              AGENT_STATE.UNAVAILABLE.value, CONTACT_STATE.ASSIGNED.value, 
+                                              CONTACT_STATE.COMPLETE.value, timestamp+1000)
+            match SCRIPT_STATUS(status):
+                case SCRIPT_STATUS.OK:
+                    logger.info('%s assigned to %s', contact_key, agent)
+                case SCRIPT_STATUS.NO_CHANGE:
+                    logger.info('%s queued', contact_key)
+                    # wait only if no agent has become available since the script checked
+                    async with avail.cond:
+                        try:
+                            await asyncio.wait_for(avail.cond.wait_for(lambda: avail.count != seen), AVAIL_WAIT)
+                        except asyncio.TimeoutError:
+                            pass
         except Exception as err:
             if str(err) != "Connection closed by server.":
                 logger.error(err)
                 raise err
+
+async def main(client: Redis,
+               workers: int) -> None:
+    """ 
+        Loads the Lua scripts and runs concurrent dispatch workers.  BZPOPMIN pops each contact to exactly one
+        worker, so no further coordination between workers is necessary.  One agent_available listener is shared
+        by all workers.
+        
+        Parameters
+        ----------
+        client - Redis asyncio client
+        workers - number of dispatch workers
+ 
+        Returns
+        -------
+        None
+    """
+    await scripts.load(client)
+    pubsub: PubSub = client.pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe(scripts.AGENT_AVAILABLE)
+    avail: Availability = Availability()
+    await asyncio.gather(listen(pubsub, avail), *(dispatch(client, avail) for _ in range(workers)))
             
 if __name__ == '__main__':
     load_dotenv(override=True)
-    client:Redis = aioredis.from_url(os.getenv('REDIS_URL'))
-    asyncio.run(dispatch(client))             
\ No newline at end of file
+    client:Redis = aioredis.from_url(os.getenv('REDIS_URL'), decode_responses=True)
+    uvloop.install()
+    asyncio.run(main(client, int(os.getenv('DISPATCH_WORKERS', 1))))             
\ No newline at end of file
@@ -1,7 +1,10 @@
 import operations as ops
+import scripts
 from response import Response, RESPONSE_TYPE
 from states import ACD_STATE, AGENT_STATE
 from fastapi import FastAPI, HTTPException, status, Body, Path
+from fastapi import Response as HTTPResponse
+from pydantic import BaseModel
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
@@ -12,10 +15,16 @@ import json
 
 client: Redis = None
 
+class Agent(BaseModel):
+    id: str
+    fname: str
+    lname: str
+    skills: list[str]
+
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> None:
     """ 
-        FastAPI start up and shut down procedures.  Initializes the Redis asyncio client.
+        FastAPI start up and shut down procedures.  Initializes the Redis asyncio client and loads the Lua scripts.
         
         Parameters
         ----------
@@ -27,7 +36,8 @@ async def lifespan(app: FastAPI) -> None:
     """
     load_dotenv(override=True)
     global client
-    client = aioredis.from_url(os.getenv('REDIS_URL'))
+    client = aioredis.from_url(os.getenv('REDIS_URL'), decode_responses=True)
+    await scripts.load(client)
     yield
     await client.quit()
 
@@ -134,6 +144,30 @@ async def create_agent(agent_key: Annotated[str, Path()],
     else:
         raise HTTPException(status_code=response.resp_type, detail=response.result)
 
+@app.post('/agents/batch', status_code=status.HTTP_201_CREATED)
+async def create_agents(agents: Annotated[list[Agent], Body(embed=True)],
+                        http_response: HTTPResponse) -> None:
+    """ 
+        Route for creating a batch of agents in a single request.  Responds with 207 (Multi-Status) and
+        the associated errors if some of the agents could not be created.
+        
+        Parameters
+        ----------
+        agents - body param with array of agents, each with an id (Redis key), fname, lname and skills
+ 
+        Returns
+        -------
+        None
+    """   
+    response: Response = await ops.create_agents(client, [agent.model_dump() for agent in agents]) 
+    if response.resp_type == RESPONSE_TYPE.OK:
+        return response.result
+    elif response.resp_type == RESPONSE_TYPE.MULTI_STATUS:
+        http_response.status_code = status.HTTP_207_MULTI_STATUS
+        return response.result
+    else:
+        raise HTTPException(status_code=response.resp_type, detail=response.result)
+
 @app.delete('/agent/{agent_key}', status_code=status.HTTP_200_OK)
 async def delete_agent(agent_key: Annotated[str, Path()]) -> None:
     """ 
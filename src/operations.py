@@ -1,14 +1,40 @@
 import time
-from redis.asyncio.lock import Lock
 from redis import Redis
 from response import Response, RESPONSE_TYPE
 from states import ACD_STATE, AGENT_STATE, CONTACT_STATE
 from uuid import uuid4
 import json
+import logging
+import scripts
+from scripts import SCRIPT_STATUS, avail_key
 
-LOCK_TIMEOUT = 1 # 1 sec
-BLOCK_TIME = .1  # 100 ms
 CONTACT_TTL = 60*60 #3600 sec/1 hr
+SCRIPT_BATCH = 500 # max keys per Lua script call
+SCAN_COUNT = 1000 # SSCAN page size hint
+
+logger = logging.getLogger('operations')
+
+async def _agent_batches(client: Redis):
+    """ 
+        Iterates the keys of all agents in batches suitable for passing to a Lua script.  Agent keys are
+        maintained in the 'agents' Redis Set, which is streamed via SSCAN rather than read whole.
+        
+        Parameters
+        ----------
+        client - Redis asyncio client
+ 
+        Yields
+        ------
+        list[str] - up to SCRIPT_BATCH agent keys
+    """
+    batch: list[str] = []
+    async for agent_key in client.sscan_iter(scripts.AGENTS, count=SCAN_COUNT):
+        batch.append(agent_key)
+        if len(batch) == SCRIPT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 async def set_acd_state(client: Redis,
                         acd_state: ACD_STATE) -> Response:
@@ -24,30 +50,22 @@ async def set_acd_state(client: Redis,
         -------
         Response - object containing status and result
     """
-    resp_type: RESPONSE_TYPE = None
-    result: str = None
-    agent_state: AGENT_STATE = None
- 
     try:
         match acd_state:
             case ACD_STATE.OPEN:
-                agent_state = AGENT_STATE.AVAILABLE
+                agent_state: AGENT_STATE = AGENT_STATE.AVAILABLE
             case ACD_STATE.CLOSED:
                 agent_state = AGENT_STATE.UNAVAILABLE
             case _:
-                result = f'set_acd_state - invalid acd state'
-                resp_type = RESPONSE_TYPE.ERR
+                return Response(RESPONSE_TYPE.ERR, 'set_acd_state - invalid acd state')
         
-        if agent_state:
-            async for agent_key in client.scan_iter(f'agent:*'):
-                await set_agent_state(client, agent_key, agent_state)
-            resp_type = RESPONSE_TYPE.OK  
-            result = acd_state.value      
+        timestamp: int = time.time_ns() // 1_000_000
+        async for agent_keys in _agent_batches(client):
+            await scripts.run(client, 'set_agents_state', len(agent_keys), *agent_keys, 
+                              agent_state.value, AGENT_STATE.AVAILABLE.value, timestamp)
+        return Response(RESPONSE_TYPE.OK, acd_state.value)
     except Exception as err:
-        result = f'set_acd_state - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        return Response(resp_type, result)
+        return Response(RESPONSE_TYPE.ERR, f'set_acd_state - {err}')
        
 async def create_contact(client: Redis,
                          skills: list[str]) -> Response:
@@ -63,19 +81,13 @@ async def create_contact(client: Redis,
         -------
         Response - object containing status and result
     """    
-    resp_type: RESPONSE_TYPE = None
-    result: str = None
     contact_key: str = f'contact:{str(uuid4())}'
     try:
         await client.json().set(contact_key, '$', {'skills': skills, 'state': CONTACT_STATE.QUEUED.value, 'agent': None})
-        await client.zadd('queue', mapping={ contact_key: round(time.time()*1000) })  #time in ms
-        resp_type = RESPONSE_TYPE.OK
-        result = contact_key
+        await client.zadd('queue', mapping={ contact_key: time.time_ns() // 1_000_000 })  #time in ms
+        return Response(RESPONSE_TYPE.OK, contact_key)
     except Exception as err:
-        result = f'create_contact - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        return Response(resp_type, result)
+        return Response(RESPONSE_TYPE.ERR, f'create_contact - {err}')
     
 async def complete_contact(client: Redis,
                            contact_key: str) -> Response:
@@ -92,20 +104,14 @@ async def complete_contact(client: Redis,
         -------
         Response - object containing status and result
     """    
-    resp_type: RESPONSE_TYPE = None
-    result: str = None
     try:
         pipe: Redis = await client.pipeline(transaction=True)
         await pipe.json().set(contact_key, '$.state', CONTACT_STATE.COMPLETE.value)
         await pipe.expire(contact_key, CONTACT_TTL)
         await pipe.execute()
-        resp_type = RESPONSE_TYPE.OK
-        result = contact_key
+        return Response(RESPONSE_TYPE.OK, contact_key)
     except Exception as err:
-        result = f'complete_contact - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        return Response(resp_type, result)
+        return Response(RESPONSE_TYPE.ERR, f'complete_contact - {err}')
 
 async def get_contact(client: Redis,
                       contact_key: str) -> Response:
@@ -121,22 +127,15 @@ async def get_contact(client: Redis,
         -------
         Response - object containing status and result
     """   
-    resp_type: RESPONSE_TYPE = None
-    result: str = None
     try:
         contact: dict = await client.json().get(contact_key)
-        print(f'contact: {contact}')
+        logger.debug('contact %s', contact)
         if contact:
-            result = json.dumps(contact)
-            resp_type = RESPONSE_TYPE.OK
+            return Response(RESPONSE_TYPE.OK, json.dumps(contact))
         else:
-            result = f'get_contact - {contact_key} does not exist'
-            resp_type = RESPONSE_TYPE.ERR
+            return Response(RESPONSE_TYPE.ERR, f'get_contact - {contact_key} does not exist')
     except Exception as err:
-        result = f'get_contact - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        return Response(resp_type, result)
+        return Response(RESPONSE_TYPE.ERR, f'get_contact - {err}')
     
 async def create_agent(client: Redis, 
                        agent_key: str, 
@@ -158,30 +157,52 @@ async def create_agent(client: Redis,
         -------
         Response - object containing status and result
     """   
-    resp_type: RESPONSE_TYPE = None
-    result: str = None
     try:
-        lock: Lock = Lock(redis=client, name=f'{agent_key}:lock', timeout=LOCK_TIMEOUT, blocking_timeout=BLOCK_TIME)
-        lock_acquired: bool = await lock.acquire()
-        if lock_acquired:
-            exists: int = await client.exists(agent_key)
-            if exists:
-                result = f'create_agent - agent {agent_key} already exists'
-                resp_type = RESPONSE_TYPE.ERR
-            else:
-                agent_obj: dict = { 'id': agent_key, 'fname': fname, 'lname': lname, 'skills': skills, 'state': AGENT_STATE.UNAVAILABLE.value }
-                await client.json().set(agent_key, '$', agent_obj)
-                result = agent_key
-                resp_type = RESPONSE_TYPE.OK
+        agent_obj: dict = { 'id': agent_key, 'fname': fname, 'lname': lname, 'skills': skills, 'state': AGENT_STATE.UNAVAILABLE.value }
+        status: int = await scripts.run(client, 'create_agent', 1, agent_key, json.dumps(agent_obj))
+        if SCRIPT_STATUS(status) == SCRIPT_STATUS.EXISTS:
+            return Response(RESPONSE_TYPE.ERR, f'create_agent - agent {agent_key} already exists')
         else:
-            resp_type = RESPONSE_TYPE.LOCKED
+            return Response(RESPONSE_TYPE.OK, agent_key)
     except Exception as err:
-        result = f'create_agent - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        if await lock.locked():
-            await lock.release()
-        return Response(resp_type, result)
+        return Response(RESPONSE_TYPE.ERR, f'create_agent - {err}')
+
+async def create_agents(client: Redis,
+                        agents: list[dict]) -> Response:
+    """ 
+        Operation for creating a batch of agents
+        
+        Parameters
+        ----------
+        client - Redis asyncio client
+        agents - array of agents, each with an id (Redis key), fname, lname and skills
+ 
+        Returns
+        -------
+        Response - object containing status and result.  The result holds the keys of the agents created and, if
+            any agent could not be created, the associated errors.
+    """   
+    try:
+        created: list[str] = []
+        errors: list[str] = []
+        for i in range(0, len(agents), SCRIPT_BATCH):
+            agent_objs: list[dict] = [{ 'id': agent['id'], 'fname': agent['fname'], 'lname': agent['lname'], 
+                                        'skills': agent['skills'], 'state': AGENT_STATE.UNAVAILABLE.value } 
+                                      for agent in agents[i:i+SCRIPT_BATCH]]
+            statuses: list[int] = await scripts.run(client, 'create_agents', len(agent_objs), 
+                                                    *[agent_obj['id'] for agent_obj in agent_objs],
+                                                    *[json.dumps(agent_obj) for agent_obj in agent_objs])
+            for agent_obj, status in zip(agent_objs, statuses):
+                if SCRIPT_STATUS(status) == SCRIPT_STATUS.EXISTS:
+                    errors.append(f'create_agents - agent {agent_obj["id"]} already exists')
+                else:
+                    created.append(agent_obj['id'])
+        if errors:
+            return Response(RESPONSE_TYPE.MULTI_STATUS, {'agent_keys': created, 'errors': errors})
+        else:
+            return Response(RESPONSE_TYPE.OK, {'agent_keys': created})
+    except Exception as err:
+        return Response(RESPONSE_TYPE.ERR, f'create_agents - {err}')
 
 async def delete_agent(client: Redis,  
                        agent_key: str) -> Response:
@@ -197,33 +218,14 @@ async def delete_agent(client: Redis,
         -------
         Response - object containing status and result
     """   
-    resp_type: RESPONSE_TYPE = None
-    result: str = None
-
     try:
-        lock: Lock = Lock(redis=client, name=f'{agent_key}:lock', timeout=LOCK_TIMEOUT, blocking_timeout=BLOCK_TIME)
-        lock_acquired: bool = await lock.acquire()
-        if lock_acquired:
-            exists: int = await client.exists(agent_key)
-            if not exists:
-                result = f'delete_agent - agent {agent_key} does not exist'
-                resp_type = RESPONSE_TYPE.ERR
-            else:
-                skills: list[list[str]] = await client.json().get(agent_key, '$.skills')    
-                for skill in skills[0]:
-                    await client.zrem(f'{{availAgentsSkill}}:{skill}', agent_key)
-                await client.json().delete(agent_key)
-                resp_type = RESPONSE_TYPE.OK
-                result = agent_key
+        status: int = await scripts.run(client, 'delete_agent', 1, agent_key)
+        if SCRIPT_STATUS(status) == SCRIPT_STATUS.NOT_FOUND:
+            return Response(RESPONSE_TYPE.ERR, f'delete_agent - agent {agent_key} does not exist')
         else:
-            resp_type = RESPONSE_TYPE.LOCKED
+            return Response(RESPONSE_TYPE.OK, agent_key)
     except Exception as err:
-        result = f'delete_agent - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        if await lock.locked():
-            await lock.release()
-        return Response(resp_type, result)
+        return Response(RESPONSE_TYPE.ERR, f'delete_agent - {err}')
     
 async def set_agent_state(client: Redis, 
                           agent_key: str,
@@ -241,45 +243,20 @@ async def set_agent_state(client: Redis,
         -------
         Response - object containing status and result
     """   
-    resp_type: RESPONSE_TYPE = None
-    result: str = None
-
     try:
-        lock: Lock = Lock(redis=client, name=f'{agent_key}:lock', timeout=LOCK_TIMEOUT, blocking_timeout=BLOCK_TIME)
-        lock_acquired: bool = await lock.acquire()
-        if lock_acquired:
-            exists: int = await client.exists(agent_key)
-            if not exists:
-                result = f'set_agent_state - {agent_key} does not exist'
-                resp_type = RESPONSE_TYPE.ERR
-            else:
-                current_state = (await client.json().get(agent_key, '$.state'))[0]
-                if AGENT_STATE(current_state) != state: 
-                    skills: list[list[str]] = await client.json().get(agent_key, '$.skills')    
-                    for skill in skills[0]:
-                        match state:
-                            case AGENT_STATE.AVAILABLE: 
-                                await client.zadd(f'{{availAgentsSkill}}:{skill}', mapping={ agent_key: round(time.time()*1000) })
-                                await client.json().set(agent_key, '$.state', AGENT_STATE.AVAILABLE.value)  
-                            case AGENT_STATE.UNAVAILABLE:
-                                await client.zrem(f'{{availAgentsSkill}}:{skill}', agent_key)
-                                await client.json().set(agent_key, '$.state', AGENT_STATE.UNAVAILABLE.value)  
-                            case _:
-                                raise Exception(f'invalid agent state parameter: {state}') 
-                    result = agent_key
-                    resp_type = RESPONSE_TYPE.OK
-                else:
-                    result = f'set_agent_state - {agent_key} already in {AGENT_STATE(current_state)}'
-                    resp_type = RESPONSE_TYPE.ERR
-        else:
-            resp_type = RESPONSE_TYPE.LOCKED
+        if state not in (AGENT_STATE.AVAILABLE, AGENT_STATE.UNAVAILABLE):
+            raise Exception(f'invalid agent state parameter: {state}') 
+        status: int = await scripts.run(client, 'set_agent_state', 1, agent_key, 
+                                        state.value, AGENT_STATE.AVAILABLE.value, time.time_ns() // 1_000_000)
+        match SCRIPT_STATUS(status):
+            case SCRIPT_STATUS.NOT_FOUND:
+                return Response(RESPONSE_TYPE.ERR, f'set_agent_state - {agent_key} does not exist')
+            case SCRIPT_STATUS.NO_CHANGE:
+                return Response(RESPONSE_TYPE.ERR, f'set_agent_state - {agent_key} already in AGENT_STATE.{state.name}')
+            case _:
+                return Response(RESPONSE_TYPE.OK, agent_key)
     except Exception as err:
-        result = f'set_agent_state - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        if await lock.locked():
-            await lock.release()
-        return Response(resp_type, result)
+        return Response(RESPONSE_TYPE.ERR, f'set_agent_state - {err}')
 
 async def change_agent_info(client: Redis, 
                             agent_key: str, 
@@ -299,23 +276,15 @@ async def change_agent_info(client: Redis,
         -------
         Response - object containing status and result
     """
-    resp_type: RESPONSE_TYPE = None
-    result: str = None
-
     try:
         exists: int = await client.exists(agent_key)
         if not exists:
-            result = f'change_agent_info - {agent_key} does not exist'
-            resp_type = RESPONSE_TYPE.ERR
+            return Response(RESPONSE_TYPE.ERR, f'change_agent_info - {agent_key} does not exist')
         else:
             await client.json().mset([(agent_key, '$.fname', fname),  (agent_key, '$.lname', lname)])
-            result = agent_key
-            resp_type = RESPONSE_TYPE.OK
+            return Response(RESPONSE_TYPE.OK, agent_key)
     except Exception as err:
-        result = f'change_agent_info - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        return Response(resp_type, result)
+        return Response(RESPONSE_TYPE.ERR, f'change_agent_info - {err}')
 
 async def add_agent_skill(client: Redis,
                           agent_key: str,
@@ -336,33 +305,15 @@ async def add_agent_skill(client: Redis,
         -------
         Response - object containing status and result
     """
-    resp_type: RESPONSE_TYPE = None
-    result: str = None 
-
     try:
-        lock: Lock = Lock(redis=client, name=f'{agent_key}:lock', timeout=LOCK_TIMEOUT, blocking_timeout=BLOCK_TIME)
-        lock_acquired: bool = await lock.acquire()
-        if lock_acquired:
-            exists: int = await client.exists(agent_key)
-            if not exists:
-                result = f'add_agent_skill - {agent_key} does not exist'
-                resp_type = RESPONSE_TYPE.ERR
-            else:
-                await client.json().arrappend(agent_key, '$.skills', skill)
-                current_state = (await client.json().get(agent_key, '$.state'))[0]
-                if AGENT_STATE(current_state) == AGENT_STATE.AVAILABLE:
-                    await client.zadd(f'{{availAgentsSkill}}:{skill}', mapping={ agent_key: round(time.time()*1000) })
-                result = agent_key
-                resp_type = RESPONSE_TYPE.OK
+        status: int = await scripts.run(client, 'add_agent_skill', 1, agent_key, 
+                                        skill, AGENT_STATE.AVAILABLE.value, time.time_ns() // 1_000_000)
+        if SCRIPT_STATUS(status) == SCRIPT_STATUS.NOT_FOUND:
+            return Response(RESPONSE_TYPE.ERR, f'add_agent_skill - {agent_key} does not exist')
         else:
-            resp_type = RESPONSE_TYPE.LOCKED
+            return Response(RESPONSE_TYPE.OK, agent_key)
     except Exception as err:
-        result = f'add_agent_skill - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        if await lock.locked():
-            await lock.release()
-        return Response(resp_type, result)
+        return Response(RESPONSE_TYPE.ERR, f'add_agent_skill - {err}')
 
 async def delete_agent_skill(client: Redis,
                              agent_key: str,
@@ -381,36 +332,17 @@ async def delete_agent_skill(client: Redis,
         -------
         Response - object containing status and result
     """
-    resp_type: RESPONSE_TYPE = None
-    result: str = None 
-
     try:
-        lock: Lock = Lock(redis=client, name=f'{agent_key}:lock', timeout=LOCK_TIMEOUT, blocking_timeout=BLOCK_TIME)
-        lock_acquired: bool = await lock.acquire()
-        if lock_acquired:
-            exists: int = await client.exists(agent_key)
-            if not exists:
-                result = f'delete_agent_skill - {agent_key} does not exist'
-                resp_type = RESPONSE_TYPE.ERR
-            else:
-                idx: int = (await client.json().arrindex(agent_key, '$.skills', skill))[0]
-                if idx >= 0:
-                    await client.json().arrpop(agent_key, '$.skills', idx)
-                    await client.zrem(f'{{availAgentsSkill}}:{skill}', agent_key)
-                    result = agent_key
-                    resp_type = RESPONSE_TYPE.OK
-                else:
-                    resp_type = RESPONSE_TYPE.ERR
-                    result = f'delete_agent_skill - agent does not have skill {skill}'
-        else:
-            resp_type = RESPONSE_TYPE.LOCKED
+        status: int = await scripts.run(client, 'delete_agent_skill', 1, agent_key, skill)
+        match SCRIPT_STATUS(status):
+            case SCRIPT_STATUS.NOT_FOUND:
+                return Response(RESPONSE_TYPE.ERR, f'delete_agent_skill - {agent_key} does not exist')
+            case SCRIPT_STATUS.NO_CHANGE:
+                return Response(RESPONSE_TYPE.ERR, f'delete_agent_skill - agent does not have skill {skill}')
+            case _:
+                return Response(RESPONSE_TYPE.OK, agent_key)
     except Exception as err:
-        result = f'delete_agent_skill - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        if await lock.locked():
-            await lock.release()
-        return Response(resp_type, result)
+        return Response(RESPONSE_TYPE.ERR, f'delete_agent_skill - {err}')
 
 async def delete_skill(client: Redis,
                        skill: str) -> Response:
@@ -427,16 +359,10 @@ async def delete_skill(client: Redis,
         -------
         Response - object containing status and result
     """
-    resp_type: RESPONSE_TYPE = None
-    result: str = None 
     try:
-        await client.delete(f'{{availAgentsSkill}}:{skill}')
-        async for agent_key in client.scan_iter('agent:*'):
-            await delete_agent_skill(client, agent_key, skill)
-        result = skill
-        resp_type = RESPONSE_TYPE.OK
+        await client.delete(avail_key(skill))
+        async for agent_keys in _agent_batches(client):
+            await scripts.run(client, 'delete_agents_skill', len(agent_keys), *agent_keys, skill)
+        return Response(RESPONSE_TYPE.OK, skill)
     except Exception as err:
-        result = f'delete_skill - {err}'
-        resp_type = RESPONSE_TYPE.ERR
-    finally:
-        return Response(resp_type, result)
\ No newline at end of file
+        return Response(RESPONSE_TYPE.ERR, f'delete_skill - {err}')
\ No newline at end of file
@@ -1,15 +1,17 @@
+from dataclasses import dataclass
 from enum import Enum
 
 class RESPONSE_TYPE(Enum):
     OK = 200
+    MULTI_STATUS = 207
     QUEUED = 202
     LOCKED = 409
     ERR = 400
 
-class Response(object):
-    def __init__(self, resp_type, result=None):
-        self.resp_type: RESPONSE_TYPE = resp_type
-        self.result: str = result
-    
+@dataclass(slots=True)
+class Response:
+    resp_type: RESPONSE_TYPE
+    result: str | dict | None = None
+
     def __str__(self):
         return f'resp_type: {self.resp_type}, result: {self.result}'
\ No newline at end of file
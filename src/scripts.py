@@ -0,0 +1,302 @@
+"""
+    Lua scripts executed server-side by Redis.  Each script performs a multi-step ACD operation atomically
+    and in a single round trip.
+"""
+from enum import Enum
+from redis import Redis
+from redis.exceptions import NoScriptError
+from typing import Any
+
+class SCRIPT_STATUS(Enum):
+    OK = 0
+    NOT_FOUND = 1
+    EXISTS = 2
+    NO_CHANGE = 3
+
+AGENTS: str = 'agents'  # Set of all agent keys
+SKILL_SET_PREFIX: str = '{availAgentsSkill}:'  # key prefix of the per-skill agent availability Sorted Sets
+AGENT_AVAILABLE: str = 'agent_available'  # pub/sub channel notified when agents become available
+
+# Declares the key and channel names above as Lua locals for the scripts that use them
+_NAMES: str = f"""
+local AGENTS = '{AGENTS}'
+local SKILL_SET_PREFIX = '{SKILL_SET_PREFIX}'
+local AGENT_AVAILABLE = '{AGENT_AVAILABLE}'"""
+
+def avail_key(skill: str) -> str:
+    """ 
+        Builds the key of a skill's availability Sorted Set.
+        
+        Parameters
+        ----------
+        skill - skill name
+ 
+        Returns
+        -------
+        str - Redis key for the skill availability set
+    """
+    return SKILL_SET_PREFIX + skill
+
+# Attempts to assign a contact to the longest available agent possessing all of its requisite skills.  An agent
+# is claimed by removing it from its skill availability sets; membership in those sets implies availability.
+# If no agent is available and the contact has not been completed (abandoned), it is put back on the queue.
+#   KEYS[1] - contact key
+#   KEYS[2] - queue key
+#   ARGV[1] - AGENT_STATE.UNAVAILABLE
+#   ARGV[2] - CONTACT_STATE.ASSIGNED
+#   ARGV[3] - CONTACT_STATE.COMPLETE
+#   ARGV[4] - queue score to use if the contact is put back on the queue
+# Returns a SCRIPT_STATUS value and the key of the assigned agent:  OK if assigned, NO_CHANGE if requeued,
+# NOT_FOUND if the contact no longer exists or was completed.
+DISPATCH: str = _NAMES + """
+local contact = redis.call('JSON.GET', KEYS[1], '$.skills', '$.state')
+if not contact then
+    return {1, false}
+end
+contact = cjson.decode(contact)
+local avail_keys = {}
+for i, skill in ipairs(contact['$.skills'][1]) do
+    avail_keys[i] = SKILL_SET_PREFIX .. skill
+end
+local agents = redis.call('ZINTER', #avail_keys, unpack(avail_keys))
+for _, agent in ipairs(agents) do
+    local agent_skills = redis.call('JSON.GET', agent, '$.skills')
+    local claimed = 0
+    if agent_skills then
+        for _, skill in ipairs(cjson.decode(agent_skills)[1]) do
+            claimed = claimed + redis.call('ZREM', SKILL_SET_PREFIX .. skill, agent)
+        end
+    end
+    if claimed > 0 then
+        redis.call('JSON.SET', agent, '$.state', ARGV[1])
+        redis.call('JSON.SET', KEYS[1], '$.agent', cjson.encode(agent))
+        redis.call('JSON.SET', KEYS[1], '$.state', ARGV[2])
+        return {0, agent}
+    end
+end
+if contact['$.state'][1] == tonumber(ARGV[3]) then
+    return {1, false}
+end
+redis.call('ZADD', KEYS[2], ARGV[4], KEYS[1])
+return {3, false}
+"""
+
+# Applies a state to a batch of agents, adding them to or removing them from their skill availability sets.
+# Agents already in the requested state are skipped.
+#   KEYS - agent keys
+#   ARGV[1] - new agent state
+#   ARGV[2] - AGENT_STATE.AVAILABLE
+#   ARGV[3] - timestamp (ms) used as the availability score
+# Publishes to the agent_available channel if any agent became available.
+# Returns the number of agents changed.
+SET_AGENTS_STATE: str = _NAMES + """
+local state = tonumber(ARGV[1])
+local changed = 0
+for _, agent in ipairs(KEYS) do
+    local obj = redis.call('JSON.GET', agent, '$.state', '$.skills')
+    obj = obj and cjson.decode(obj)
+    if obj and obj['$.state'][1] ~= state then
+        for _, skill in ipairs(obj['$.skills'][1]) do
+            if state == tonumber(ARGV[2]) then
+                redis.call('ZADD', SKILL_SET_PREFIX .. skill, ARGV[3], agent)
+            else
+                redis.call('ZREM', SKILL_SET_PREFIX .. skill, agent)
+            end
+        end
+        redis.call('JSON.SET', agent, '$.state', ARGV[1])
+        changed = changed + 1
+    end
+end
+if changed > 0 and state == tonumber(ARGV[2]) then
+    redis.call('PUBLISH', AGENT_AVAILABLE, changed)
+end
+return changed
+"""
+
+# Removes a skill from a batch of agents and removes them from the skill's availability set.
+#   KEYS - agent keys
+#   ARGV[1] - skill
+# Returns the number of agents changed.
+DELETE_AGENTS_SKILL: str = _NAMES + """
+local skill = cjson.encode(ARGV[1])
+local changed = 0
+for _, agent in ipairs(KEYS) do
+    if redis.call('EXISTS', agent) == 1 then
+        local idx = redis.call('JSON.ARRINDEX', agent, '$.skills', skill)[1]
+        if idx and idx >= 0 then
+            redis.call('JSON.ARRPOP', agent, '$.skills', idx)
+            redis.call('ZREM', SKILL_SET_PREFIX .. ARGV[1], agent)
+            changed = changed + 1
+        end
+    end
+end
+return changed
+"""
+
+# Creates an agent if it does not already exist and adds it to the agents set.
+#   KEYS[1] - agent key
+#   ARGV[1] - agent JSON object
+# Returns a SCRIPT_STATUS value.
+CREATE_AGENT: str = _NAMES + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 2
+end
+redis.call('JSON.SET', KEYS[1], '$', ARGV[1])
+redis.call('SADD', AGENTS, KEYS[1])
+return 0
+"""
+
+# Creates a batch of agents.  Agents that already exist are left untouched.
+#   KEYS - agent keys
+#   ARGV - agent JSON objects, in the same order as KEYS
+# Returns an array of SCRIPT_STATUS values, one per agent.
+CREATE_AGENTS: str = _NAMES + """
+local status = {}
+for i, agent in ipairs(KEYS) do
+    if redis.call('EXISTS', agent) == 1 then
+        status[i] = 2
+    else
+        redis.call('JSON.SET', agent, '$', ARGV[i])
+        redis.call('SADD', AGENTS, agent)
+        status[i] = 0
+    end
+end
+return status
+"""
+
+# Deletes an agent and removes it from its skill availability sets and the agents set.
+#   KEYS[1] - agent key
+# Returns a SCRIPT_STATUS value.
+DELETE_AGENT: str = _NAMES + """
+local skills = redis.call('JSON.GET', KEYS[1], '$.skills')
+if not skills then
+    return 1
+end
+for _, skill in ipairs(cjson.decode(skills)[1]) do
+    redis.call('ZREM', SKILL_SET_PREFIX .. skill, KEYS[1])
+end
+redis.call('JSON.DEL', KEYS[1])
+redis.call('SREM', AGENTS, KEYS[1])
+return 0
+"""
+
+# Applies a state to an agent, adding it to or removing it from its skill availability sets.
+#   KEYS[1] - agent key
+#   ARGV[1] - new agent state
+#   ARGV[2] - AGENT_STATE.AVAILABLE
+#   ARGV[3] - timestamp (ms) used as the availability score
+# Publishes the agent key to the agent_available channel if the agent became available.
+# Returns a SCRIPT_STATUS value.
+SET_AGENT_STATE: str = _NAMES + """
+local obj = redis.call('JSON.GET', KEYS[1], '$.state', '$.skills')
+if not obj then
+    return 1
+end
+obj = cjson.decode(obj)
+local state = tonumber(ARGV[1])
+if obj['$.state'][1] == state then
+    return 3
+end
+for _, skill in ipairs(obj['$.skills'][1]) do
+    if state == tonumber(ARGV[2]) then
+        redis.call('ZADD', SKILL_SET_PREFIX .. skill, ARGV[3], KEYS[1])
+    else
+        redis.call('ZREM', SKILL_SET_PREFIX .. skill, KEYS[1])
+    end
+end
+redis.call('JSON.SET', KEYS[1], '$.state', ARGV[1])
+if state == tonumber(ARGV[2]) then
+    redis.call('PUBLISH', AGENT_AVAILABLE, KEYS[1])
+end
+return 0
+"""
+
+# Adds a skill to an agent.  An available agent is also added to the skill's availability set and published
+# to the agent_available channel.
+#   KEYS[1] - agent key
+#   ARGV[1] - skill
+#   ARGV[2] - AGENT_STATE.AVAILABLE
+#   ARGV[3] - timestamp (ms) used as the availability score
+# Returns a SCRIPT_STATUS value.
+ADD_AGENT_SKILL: str = _NAMES + """
+local current = redis.call('JSON.GET', KEYS[1], '$.state')
+if not current then
+    return 1
+end
+redis.call('JSON.ARRAPPEND', KEYS[1], '$.skills', cjson.encode(ARGV[1]))
+if cjson.decode(current)[1] == tonumber(ARGV[2]) then
+    redis.call('ZADD', SKILL_SET_PREFIX .. ARGV[1], ARGV[3], KEYS[1])
+    redis.call('PUBLISH', AGENT_AVAILABLE, KEYS[1])
+end
+return 0
+"""
+
+# Removes a skill from an agent and removes the agent from the skill's availability set.
+#   KEYS[1] - agent key
+#   ARGV[1] - skill
+# Returns a SCRIPT_STATUS value.
+DELETE_AGENT_SKILL: str = _NAMES + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 1
+end
+local idx = redis.call('JSON.ARRINDEX', KEYS[1], '$.skills', cjson.encode(ARGV[1]))[1]
+if not idx or idx < 0 then
+    return 3
+end
+redis.call('JSON.ARRPOP', KEYS[1], '$.skills', idx)
+redis.call('ZREM', SKILL_SET_PREFIX .. ARGV[1], KEYS[1])
+return 0
+"""
+
+SCRIPTS: dict[str, str] = {
+    'dispatch': DISPATCH,
+    'set_agents_state': SET_AGENTS_STATE,
+    'delete_agents_skill': DELETE_AGENTS_SKILL,
+    'create_agent': CREATE_AGENT,
+    'create_agents': CREATE_AGENTS,
+    'delete_agent': DELETE_AGENT,
+    'set_agent_state': SET_AGENT_STATE,
+    'add_agent_skill': ADD_AGENT_SKILL,
+    'delete_agent_skill': DELETE_AGENT_SKILL
+}
+SHAS: dict[str, str] = {}
+
+async def load(client: Redis) -> dict[str, str]:
+    """ 
+        Loads all scripts into the Redis script cache and caches their SHA1 digests.
+        
+        Parameters
+        ----------
+        client - Redis asyncio client
+ 
+        Returns
+        -------
+        dict[str, str] - script name to SHA1 digest
+    """
+    for name, script in SCRIPTS.items():
+        SHAS[name] = await client.script_load(script)
+    return SHAS
+
+async def run(client: Redis,
+              name: str,
+              numkeys: int,
+              *keys_and_args) -> Any:
+    """ 
+        Executes a previously loaded script by its SHA1 digest.  If Redis no longer has the script cached
+        (e.g., after a restart), it is executed via EVAL instead, which also caches it again.
+        
+        Parameters
+        ----------
+        client - Redis asyncio client
+        name - script name
+        numkeys - number of keys in keys_and_args
+        keys_and_args - script KEYS followed by ARGV
+ 
+        Returns
+        -------
+        Any - script result
+    """
+    try:
+        return await client.evalsha(SHAS[name], numkeys, *keys_and_args)
+    except NoScriptError:
+        return await client.eval(SCRIPTS[name], numkeys, *keys_and_args)
@@ -1,44 +1,88 @@
-import requests
+import aiohttp
+import asyncio
 from argparse import ArgumentParser
 from faker import Faker
 from faker.providers import DynamicProvider
 import os
 from dotenv import load_dotenv
 from states import ACD_STATE, AGENT_STATE, CONTACT_STATE
-import time
 import logging
-import threading
+import random
+import time
+from itertools import islice
 
 NUM_AGENTS: int = 40
 NUM_CONTACTS: int = 100
+AGENT_BATCH: int = 1000  # max agents per batch create request
+MAX_IN_FLIGHT: int = 128  # max concurrently active contacts
+CONTACT_INTERVAL: float = .5  # secs between contact arrivals
+
+# constant request payloads/values, built once
+_OPEN_PAYLOAD: dict = { 'state': ACD_STATE.OPEN }
+_CLOSED_PAYLOAD: dict = { 'state': ACD_STATE.CLOSED }
+_AVAIL_PAYLOAD: dict = { 'state': AGENT_STATE.AVAILABLE }
 
 logging.basicConfig(format='%(asctime)s %(message)s')
 logger = logging.getLogger('simulator')
 logger.setLevel(logging.INFO)
 logger.info('Simulator started')
 
+_LANGS: tuple[str] = ('English', 'Spanish')
+_EXPERT: tuple[str] = ('Support', 'Disputes', 'Billing')
+
 language_provider = DynamicProvider(
     provider_name='language',
-    elements=['English', 'Spanish']
+    elements=list(_LANGS)
 )
 
 expertise_provider = DynamicProvider(
     provider_name='expertise',
-    elements=['Support', 'Disputes', 'Billing']
+    elements=list(_EXPERT)
 )
 
 Faker.seed(0)
+random.seed(0)
 fake: Faker = Faker()
 fake.add_provider(language_provider)
 fake.add_provider(expertise_provider) 
 
-def openAcd(rest_url: str, agents: int) -> None:
+# bind provider methods once to avoid Faker's dynamic attribute lookup per call
+_first_name = fake.first_name
+_last_name = fake.last_name
+_language = fake.language
+_expertise = fake.expertise
+_pyfloat = fake.pyfloat
+
+# name pools for bulk agent generation via random.choice
+_FIRST: tuple[str] = tuple(_first_name() for _ in range(1024))
+_LAST: tuple[str] = tuple(_last_name() for _ in range(1024))
+
+async def _post(session: aiohttp.ClientSession, url: str, payload: dict) -> None:
+    """ 
+        Issues a POST whose response body is not needed.
+        
+        Parameters
+        ----------
+        session - HTTP client session
+        url - request url
+        payload - JSON body
+ 
+        Returns
+        -------
+        None
+    """
+    async with session.post(url, json=payload):
+        pass
+
+async def openAcd(session: aiohttp.ClientSession, rest_url: str, agents: int) -> None:
     """ 
         Creates an ACD environment with agents each having a set of skills and then 
-        sets the ACD to the open state.
+        sets the ACD to the open state.  Agents are created via the batch endpoint in chunks of AGENT_BATCH.  If the
+        server doesn't support that endpoint, agents are created concurrently via the per-agent endpoint.
         
         Parameters
         ----------
+        session - HTTP client session
         rest_url - Base url of the REST API server
         agents - Number of agents to create.  Agents have random names and skills.
  
@@ -46,20 +90,32 @@ def openAcd(rest_url: str, agents: int) -> None:
         -------
         None
     """
-    for i in range(agents):
-        payload: dict = {
-            'fname': fake.first_name(),
-            'lname': fake.last_name(),
-            'skills': [fake.language(), fake.expertise()]
-        }
-        requests.post(f'{rest_url}/agent/agent:{i}', json=payload)
+    payloads: list[dict] = [{
+            'id': f'agent:{i}',
+            'fname': random.choice(_FIRST),
+            'lname': random.choice(_LAST),
+            'skills': [random.choice(_LANGS), random.choice(_EXPERT)]
+        } for i in range(agents)]
     
-    payload = { 
-        'state': ACD_STATE.OPEN.value  
-    }
-    requests.post(f'{rest_url}/acd', json=payload)
+    batch_url: str = rest_url + '/agents/batch'
+    agent_url: str = rest_url + '/agent/'
+    batch_supported: bool = True
+    payload_iter = iter(payloads)
+    while chunk := list(islice(payload_iter, AGENT_BATCH)):
+        if batch_supported:
+            async with session.post(batch_url, json={'agents': chunk}) as response:
+                if response.status == 207:
+                    for error in (await response.json())['errors']:
+                        logger.warning(error)
+                elif response.status not in (201, 404):
+                    logger.error('agent batch failed - %s %s', response.status, await response.text())
+                batch_supported = response.status != 404
+        if not batch_supported:
+            await asyncio.gather(*(_post(session, agent_url + payload['id'], payload) for payload in chunk))
+    
+    await _post(session, rest_url + '/acd', _OPEN_PAYLOAD)
 
-def generate(rest_url: str) -> None:
+async def generate(session: aiohttp.ClientSession, sem: asyncio.Semaphore, rest_url: str) -> None:
     """ 
         Contact generator.  Performs the following flow:
             - Creates 1 contact with random skill requirements.
@@ -70,43 +126,89 @@ def generate(rest_url: str) -> None:
         
         Parameters
         ----------
+        session - HTTP client session
+        sem - semaphore limiting the number of contacts in flight
         rest_url - Base url of the REST API server
  
         Returns
         -------
         None
     """
-    payload = { 'skills': [fake.language(), fake.expertise()] }
-    response = requests.post(f'{rest_url}/contact', json=payload)  # generate contact
-    if response.ok:
-        contact_key = response.json()['contact_key']
-        time.sleep(fake.pyfloat(min_value=1,max_value=3))
-        response = requests.get(f'{rest_url}/contact/{contact_key}')  # get contact status
-        if response.ok:
-            if CONTACT_STATE(response.json()['state']) == CONTACT_STATE.ASSIGNED:
-                logger.info(f'{contact_key} complete with {response.json()["agent"]}')
-                payload = { 'state': AGENT_STATE.AVAILABLE.value }
-                requests.patch(f'{rest_url}/agent/{response.json()["agent"]}/state', json=payload)
-            else:
-                logger.info(f'{contact_key} abandoned')
-    requests.patch(f'{rest_url}/contact/{contact_key}')  # complete contact
+    contact_url: str = rest_url + '/contact'
+    contact_key: str = None
+    async with sem:
+        payload = { 'skills': [_language(), _expertise()] }
+        async with session.post(contact_url, json=payload) as response:  # generate contact
+            if response.ok:
+                body: dict = await response.json()
+                contact_key = body['contact_key']
+        if contact_key is not None:
+            contact_key_url: str = contact_url + '/' + contact_key
+            await asyncio.sleep(_pyfloat(min_value=1,max_value=3))
+            body = None
+            async with session.get(contact_key_url) as response:  # get contact status
+                if response.ok:
+                    body = await response.json()
+            if body is not None:
+                if body['state'] == CONTACT_STATE.ASSIGNED:
+                    agent: str = body['agent']
+                    logger.info('%s complete with %s', contact_key, agent)
+                    async with session.patch(rest_url + '/agent/' + agent + '/state', json=_AVAIL_PAYLOAD):
+                        pass
+                else:
+                    logger.info('%s abandoned', contact_key)
+            async with session.patch(contact_key_url):  # complete contact
+                pass
         
-def closeAcd(rest_url: str) -> None:
+async def closeAcd(session: aiohttp.ClientSession, rest_url: str) -> None:
     """ 
         Sets the ACD to the closed state.
         
         Parameters
         ----------
+        session - HTTP client session
         rest_url - Base url of the REST API server
         
         Returns
         -------
         None
     """    
-    payload = { 
-        'state': ACD_STATE.CLOSED.value  
-    }
-    requests.post(f'{rest_url}/acd', json=payload)
+    await _post(session, rest_url + '/acd', _CLOSED_PAYLOAD)
+
+async def main(rest_url: str, agents: int, contacts: int) -> None:
+    """ 
+        Runs a simulation:  opens the ACD, generates contacts at a fixed rate of 2 per second, waits for them
+        to complete and then closes the ACD.  All HTTP requests share one pooled, keep-alive session.
+        
+        Parameters
+        ----------
+        rest_url - Base url of the REST API server
+        agents - Number of agents to create
+        contacts - Number of contacts to generate
+        
+        Returns
+        -------
+        None
+    """
+    connector: aiohttp.TCPConnector = aiohttp.TCPConnector(limit=64, keepalive_timeout=30)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await openAcd(session, rest_url, agents)
+
+        sem: asyncio.Semaphore = asyncio.Semaphore(MAX_IN_FLIGHT)
+        tasks: list[asyncio.Task] = []
+        try:
+            start: float = time.monotonic()
+            for i in range(contacts):
+                tasks.append(asyncio.create_task(generate(session, sem, rest_url)))
+                # sleep until the next scheduled arrival so launch overhead doesn't accumulate as drift
+                await asyncio.sleep(max(0, start + (i+1)*CONTACT_INTERVAL - time.monotonic()))
+            # a failed contact is logged rather than aborting the others
+            results: list = await asyncio.gather(*tasks, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error('contact failed - %r', result)
+        finally:
+            await closeAcd(session, rest_url)
 
 if __name__ == '__main__':
     parser = ArgumentParser(description='Basic ACD simulator')
@@ -118,12 +220,4 @@ if __name__ == '__main__':
 
     load_dotenv(override=True)
     rest_url: str = os.getenv('REST_URL')
-    openAcd(rest_url, args.agents)
-
-    for _ in range(args.contacts):
-        thread = threading.Thread(target=generate, args=(rest_url,))
-        thread.start()
-        time.sleep(.5)  
-    time.sleep(3)
-
-    closeAcd(rest_url)
\ No newline at end of file
+    asyncio.run(main(rest_url, args.agents, args.contacts))
\ No newline at end of file
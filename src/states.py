@@ -1,14 +1,14 @@
-from enum import Enum
+from enum import IntEnum
 
-class AGENT_STATE(Enum):
+class AGENT_STATE(IntEnum):
     AVAILABLE = 1
     UNAVAILABLE = 0
 
-class ACD_STATE(Enum):
+class ACD_STATE(IntEnum):
     OPEN = 1
     CLOSED = 0
 
-class CONTACT_STATE(Enum):
+class CONTACT_STATE(IntEnum):
     QUEUED = 1
     ASSIGNED = 2
     COMPLETE = 3
\ No newline at end of file